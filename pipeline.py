@@ -1,12 +1,26 @@
 import requests
-# import gzip # No longer needed for decompression by the script
-# import shutil # No longer needed for decompression by the script
+from requests.adapters import HTTPAdapter
+import urllib3
+import shutil
+import numpy as np
 import pandas as pd
-import json
+import orjson
 import os
-# from pybgpdump import BGPDump # REMOVE THIS
-from bgpkit_parser import BgpkitParser # ADD THIS
-from datetime import datetime, timedelta
+import subprocess
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from bgpkit_parser import BgpkitParser
+from datetime import datetime
+try:
+    import cudf # Optional GPU dataframes (RAPIDS); the CPU path is the default
+except ImportError:
+    cudf = None
+try:
+    from numba import njit # Optional JIT for the per-batch link enumeration
+except ImportError:
+    njit = None
 
 # --- Configuration ---
 # Use a specific RIPE collector (e.g., rrc00)
@@ -18,144 +32,570 @@ MRT_FILE_NAME_GZ = f"bview.{TARGET_DATE.strftime('%Y%m%d')}.0000.gz"
 MRT_URL = f"{BASE_URL}{DATE_PATH}/{MRT_FILE_NAME_GZ}"
 
 DOWNLOAD_PATH_GZ = f"{MRT_FILE_NAME_GZ}"
-# DECOMPRESSED_PATH = "latest_dump.mrt" # No longer needed
-# PARSED_JSON_PATH = "parsed_routes.json" # No longer needed as intermediate step
+# Keep the downloaded dump (plus its ETag) after a successful run, so the next run can
+# skip the download when the collector still serves the same file
+CACHE_DOWNLOAD = True
 OUTPUT_GRAPH_DIR = "site/data"
-OUTPUT_GRAPH_PATH = os.path.join(OUTPUT_GRAPH_DIR, "as_graph.json")
+# One JSON record per line so the graph can be written and read incrementally
+OUTPUT_NODES_PATH = os.path.join(OUTPUT_GRAPH_DIR, "nodes.ndjson")
+OUTPUT_LINKS_PATH = os.path.join(OUTPUT_GRAPH_DIR, "links.ndjson")
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024 # 1 MiB reads/writes while streaming the dump
+# Native bgpkit-parser CLI (`cargo install bgpkit-parser --features cli`), used when on PATH
+BGPKIT_CLI = shutil.which("bgpkit-parser")
+CLI_PIPE_BUFFER = 1 << 20 # 1 MiB buffer on the CLI's stdout pipe
+# pigz takes over gunzipping from the CLI when both are on PATH
+PIGZ = shutil.which("pigz")
+# Graph building over the CLI output is spread across this many worker processes
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_BATCH_LINES = 50000 # JSON lines handed to a worker at a time
+GRAPH_BATCH_PATHS = 100000 # AS paths turned into NumPy link keys at a time
+# Arrays at least this large are deduplicated on the GPU when cuDF is installed; smaller
+# ones (e.g. per-batch keys in pool workers) aren't worth the host/device copies
+CUDF_MIN_KEYS = 5_000_000
+# Batch link keys (mostly links already seen in earlier batches) held before they are
+# folded into a single unique array
+LINK_KEYS_COMPACT_AT = 10_000_000
+NDJSON_WRITE_BATCH = 100000 # Nodes/links formatted per write when saving
 
 # --- Helper Functions ---
-def download_mrt_file(url, dest_path):
-    """Downloads the MRT file."""
-    print(f"Attempting to download MRT file from: {url}")
+class DownloadError(Exception):
+    """Raised when the dump couldn't be downloaded while it was being parsed."""
+
+
+def etag_path_for(dest_path):
+    """Returns the sidecar file that stores the ETag of a downloaded file."""
+    return f"{dest_path}.etag"
+
+
+def read_cached_etag(dest_path):
+    """Returns the stored ETag of a downloaded file, or None if there is none."""
     try:
-        response = requests.get(url, stream=True, timeout=120)
+        with open(etag_path_for(dest_path)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def create_http_session():
+    """Creates the HTTP session used for one download (cache check + GET on one connection)."""
+    session = requests.Session()
+    # A single keep-alive connection is all we need
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # The dump is already gzipped; don't ask for another layer of transfer compression
+    session.headers["Accept-Encoding"] = "identity"
+    return session
+
+
+def is_cached_download_current(session, url, dest_path):
+    """Checks with a HEAD request whether dest_path already holds the file served at url.
+
+    The local file must match the server's Content-Length, and its stored ETag (if any)
+    must match the server's. Returns None if the server couldn't tell us.
+    """
+    if not os.path.exists(dest_path):
+        return False
+    try:
+        response = session.head(url, timeout=10, allow_redirects=True)
         response.raise_for_status()
-        with open(dest_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+    except requests.exceptions.RequestException:
+        return None
+
+    content_length = response.headers.get("Content-Length")
+    try:
+        expected_size = int(content_length)
+    except (TypeError, ValueError):
+        return None # Missing or malformed header
+    if expected_size != os.path.getsize(dest_path):
+        return False
+    etag = response.headers.get("ETag")
+    cached_etag = read_cached_etag(dest_path)
+    return etag is None or cached_etag is None or etag == cached_etag
+
+
+def copy_file_to_feed(path, feed):
+    """Writes a local file into `feed` in large blocks."""
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, feed, length=DOWNLOAD_CHUNK_SIZE)
+
+
+def download_mrt_file(url, dest_path, feed=None):
+    """Downloads the MRT file, reusing an up to date copy of it at dest_path.
+
+    If `feed` is given (e.g. the stdin of a parser process), every downloaded block (or
+    the cached file) is also written to it, and it is closed once the download ends.
+    """
+    session = create_http_session()
+    try:
+        cached = is_cached_download_current(session, url, dest_path)
+        if cached:
+            print(f"Using cached {os.path.basename(dest_path)}, skipping download")
+            if feed is not None:
+                copy_file_to_feed(dest_path, feed)
+            return True
+
+        print(f"Attempting to download MRT file from: {url}")
+        headers = {}
+        # HEAD couldn't settle it; let the server decide with a conditional GET instead
+        cached_etag = read_cached_etag(dest_path) if cached is None else None
+        if cached_etag:
+            headers["If-None-Match"] = cached_etag
+        response = session.get(url, stream=True, timeout=120, headers=headers)
+        if response.status_code == 304:
+            # Not modified: the local copy is current
+            print(f"{os.path.basename(dest_path)} not modified, using cached copy")
+            if feed is not None:
+                copy_file_to_feed(dest_path, feed)
+            return True
+        response.raise_for_status()
+
+        # Stream into a side file so a failed download never clobbers the cached dump
+        part_path = f"{dest_path}.part"
+        try:
+            # Copy the raw stream in large blocks instead of many small iter_content chunks
+            response.raw.decode_content = True
+            with open(part_path, "wb") as f:
+                if feed is None:
+                    shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+                else:
+                    while chunk := response.raw.read(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        feed.write(chunk)
+        except BaseException:
+            cleanup_files(part_path)
+            raise
+        # Drop the old ETag first so the new dump is never paired with it
+        cleanup_files(etag_path_for(dest_path))
+        os.replace(part_path, dest_path)
+        etag = response.headers.get("ETag")
+        if etag:
+            with open(etag_path_for(dest_path), "w") as f:
+                f.write(etag)
         print(f"Successfully downloaded {os.path.basename(dest_path)}")
         return True
-    except requests.exceptions.RequestException as e:
+    except BrokenPipeError:
+        # Writing to `feed` failed: the parser went away, which is not a download error
+        raise
+    # Reading response.raw directly raises urllib3 errors (e.g. a dropped connection),
+    # not requests' wrapped ones
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
         print(f"Error downloading file: {e}")
         return False
-
-# def decompress_mrt_file(...): # REMOVE this function, bgpkit handles .gz
-
-def parse_mrt_to_records(mrt_path): # Renamed function slightly
-    """Parses MRT dump file using bgpkit-parser."""
+    finally:
+        session.close()
+        if feed is not None:
+            try:
+                feed.close() # EOF for the parser, also when the download failed
+            except OSError:
+                pass # Parser already gone; its exit status reports the failure
+
+
+def as_path_to_asns(as_path):
+    """Converts a bgpkit AS path into a list of int ASNs (AS_SETs are skipped).
+
+    Accepts both forms bgpkit produces: the pybgpkit bindings' space separated string
+    (AS_SETs show up as "{a,b}"), and the CLI's JSON array, which holds plain ints for a
+    simple AS_SEQUENCE or {"ty": ..., "values": [...]} segment objects otherwise.
+    """
+    if isinstance(as_path, str):
+        # Split once and keep the plain ASNs as ints
+        return [int(asn) for asn in as_path.split() if asn.isdigit()]
+
+    asns = []
+    for segment in as_path:
+        if isinstance(segment, int):
+            asns.append(segment)
+        elif str(segment.get("ty", "")).replace("_", "").lower() == "assequence":
+            # Only AS_SEQUENCE segments form adjacencies; sets and confederation segments
+            # are skipped, like the non-digit tokens of the string form
+            asns.extend(segment.get("values", []))
+    return asns
+
+
+def iter_as_paths(mrt_path, url=None):
+    """Yields one cleaned AS path (list of int ASNs) per RIB entry in the MRT dump.
+
+    Uses the native bgpkit-parser CLI when it is installed, otherwise the Python bindings.
+    With `url`, the dump is downloaded to mrt_path while it is parsed (CLI only, see
+    iter_cli_json_lines).
+    """
+    if BGPKIT_CLI:
+        return iter_as_paths_cli(mrt_path, url)
+    return iter_as_paths_pybgpkit(mrt_path)
+
+
+def iter_as_paths_pybgpkit(mrt_path):
+    """Parses MRT dump file using the bgpkit-parser Python bindings."""
     print(f"Parsing MRT file using bgpkit-parser: {mrt_path}...")
-    records = []
-    try:
-        # BgpkitParser takes the file path directly
-        parser = BgpkitParser(filename=mrt_path)
-        count = 0
-        skipped_no_path = 0
-        # Iterate through BGP elements in the file
-        for elem in parser:
-            # We are interested in RIB entries from TABLE_DUMP_V2
-            # elem_type for RIB entries is 'RIB'
-            if elem.elem_type == "RIB":
-                 # Check if as_path exists and is not empty or None
-                if elem.as_path and str(elem.as_path).strip():
-                    # Convert AS path to a list of strings (it might already be)
-                    # Handle potential variations in how bgpkit returns the path
-                    as_path_str = str(elem.as_path) # Get string representation
-                    as_path_list = as_path_str.split() # Split by space
-
-                    record = {
-                        "prefix": str(elem.prefix),
-                        # Store AS path as a list of strings
-                        "as_path": [asn for asn in as_path_list if asn.isdigit()]
-                    }
-                    # Only add if path is not empty after cleaning
-                    if record["as_path"]:
-                        records.append(record)
-                        count += 1
-                        if count % 100000 == 0:
-                            print(f"  Parsed {count} RIB entries...")
-                    else:
-                        skipped_no_path += 1
+    # BgpkitParser takes the file path directly
+    parser = BgpkitParser(filename=mrt_path)
+    count = 0
+    skipped_no_path = 0
+    # Iterate through BGP elements in the file
+    for elem in parser:
+        # We are interested in RIB entries from TABLE_DUMP_V2
+        # elem_type for RIB entries is 'RIB'
+        if elem.elem_type == "RIB":
+            as_path = elem.as_path
+             # Check if as_path exists and is not empty or None
+            if as_path:
+                asns = as_path_to_asns(as_path)
+
+                # Only yield if path is not empty after cleaning
+                if asns:
+                    count += 1
+                    if count % 100000 == 0:
+                        print(f"  Parsed {count} RIB entries...")
+                    yield asns
                 else:
                     skipped_no_path += 1
+            else:
+                skipped_no_path += 1
+
+    print(f"Finished parsing. Total valid RIB entries found: {count}")
+    if skipped_no_path > 0:
+         print(f"Skipped {skipped_no_path} entries due to missing/empty AS paths.")
+
+
+def start_cli_processes(mrt_path, from_stdin=False):
+    """Starts the bgpkit-parser CLI on the MRT file, behind pigz for gzipped dumps if available.
+
+    With `from_stdin`, pigz reads the gzipped dump from its stdin pipe instead of mrt_path.
+    Returns the started processes; the last one is the CLI, whose stdout carries the JSON lines.
+    """
+    if from_stdin:
+        gunzip_cmd = [PIGZ, "-dc"]
+    elif PIGZ and mrt_path.endswith(".gz"):
+        gunzip_cmd = [PIGZ, "-dc", mrt_path]
+    else:
+        gunzip_cmd = None
+
+    if gunzip_cmd:
+        # pigz gunzips with separate read/write/CRC threads, so the CLI only decodes raw MRT
+        gunzip = subprocess.Popen(gunzip_cmd, stdin=subprocess.PIPE if from_stdin else None,
+                                  stdout=subprocess.PIPE, bufsize=CLI_PIPE_BUFFER)
+        parser = subprocess.Popen([BGPKIT_CLI, "--json", "/dev/stdin"], stdin=gunzip.stdout,
+                                  stdout=subprocess.PIPE, bufsize=CLI_PIPE_BUFFER)
+        gunzip.stdout.close() # The CLI owns the read end now
+        return [gunzip, parser]
+
+    # MRT decoding (including gunzip) happens in the CLI
+    parser = subprocess.Popen([BGPKIT_CLI, "--json", mrt_path],
+                              stdout=subprocess.PIPE, bufsize=CLI_PIPE_BUFFER)
+    return [parser]
+
+
+def iter_cli_json_lines(mrt_path, url=None):
+    """Runs the bgpkit-parser CLI on the MRT file and yields its raw JSON output lines.
+
+    With `url`, the dump is downloaded to mrt_path in a background thread and streamed
+    through pigz into the CLI as it arrives, so parsing overlaps the download.
+    """
+    print(f"Parsing MRT file using bgpkit-parser CLI ({BGPKIT_CLI}): {mrt_path}...")
+    # Callers only pull the as_path out of each line
+    processes = start_cli_processes(mrt_path, from_stdin=url is not None)
+    parser = processes[-1]
+    downloader = None
+    if url is not None:
+        downloader = ThreadPoolExecutor(max_workers=1)
+        download = downloader.submit(download_mrt_file, url, mrt_path, processes[0].stdin)
+    try:
+        yield from parser.stdout
+    except BaseException:
+        # Consumer stopped early (or failed); don't leave the CLI running
+        for process in processes:
+            process.kill()
+        raise
+    finally:
+        parser.stdout.close()
+        returncodes = [process.wait() for process in processes]
+        if downloader is not None:
+            downloader.shutdown()
+
+    download_ok = True
+    if url is not None:
+        try:
+            download_ok = download.result()
+        except BrokenPipeError:
+            pass # The CLI stopped reading; its exit status below says why
+
+    # Check the last stage (the CLI) first: once it exits, pigz upstream dies of SIGPIPE,
+    # and that status would hide the CLI's real one
+    for process, returncode in reversed(list(zip(processes, returncodes))):
+        if returncode != 0 and download_ok:
+            raise RuntimeError(f"{os.path.basename(process.args[0])} exited with status {returncode}")
+    # A failed download truncates the stream, which is what the stages above choked on
+    if not download_ok:
+        raise DownloadError(f"Download of {url} failed")
+
+
+def as_paths_from_json_lines(lines):
+    """Yields the cleaned AS path of every bgpkit-parser JSON line that has one."""
+    for line in lines:
+        as_path = orjson.loads(line).get("as_path")
+        # Withdrawals and entries without a path have no as_path
+        if as_path:
+            asns = as_path_to_asns(as_path)
+            if asns:
+                yield asns
+
+
+def iter_as_paths_cli(mrt_path, url=None):
+    """Parses MRT dump file by piping the bgpkit-parser CLI's JSON lines output."""
+    count = 0
+    for asns in as_paths_from_json_lines(iter_cli_json_lines(mrt_path, url)):
+        count += 1
+        if count % 100000 == 0:
+            print(f"  Parsed {count} RIB entries...")
+        yield asns
+
+    print(f"Finished parsing. Total valid RIB entries found: {count}")
+
+
+def pack_links(sources, targets):
+    """Packs undirected AS links into uint64 keys: smaller ASN in the high 32 bits, larger in the low."""
+    low = np.minimum(sources, targets).astype(np.uint64)
+    high = np.maximum(sources, targets).astype(np.uint64)
+    return (low << np.uint64(32)) | high
+
+
+def unpack_links(link_keys):
+    """Splits packed uint64 link keys back into (sources, targets) uint32 arrays."""
+    sources = (link_keys >> np.uint64(32)).astype(np.uint32)
+    targets = (link_keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+    return sources, targets
+
+
+def unique_keys(keys):
+    """Deduplicates an integer array with a hash-based unique (no sort, unlike np.unique).
+
+    Large arrays go to cuDF on the GPU when it is available, everything else to pandas.
+    """
+    if cudf is not None and len(keys) >= CUDF_MIN_KEYS:
+        return cudf.Series(keys).unique().to_numpy()
+    return pd.unique(keys)
+
+
+def merge_link_keys(key_batches):
+    """Merges arrays of packed link keys into one array of unique keys."""
+    if not key_batches:
+        return np.empty(0, dtype=np.uint64)
+    return unique_keys(np.concatenate(key_batches))
+
+
+def add_link_keys(key_batches, link_keys):
+    """Appends a batch of link keys to key_batches, compacting the list when it grows.
+
+    Most links repeat across batches, so once the pending batches outgrow both
+    LINK_KEYS_COMPACT_AT and the unique keys collected so far, everything is merged
+    into one unique array. This keeps memory near the number of unique links.
+    """
+    key_batches.append(link_keys)
+    pending = sum(len(keys) for keys in key_batches[1:])
+    if pending >= max(LINK_KEYS_COMPACT_AT, len(key_batches[0])):
+        key_batches[:] = [merge_link_keys(key_batches)]
+
+
+def collapse_and_pack(asns, lengths):
+    """Packs the links of flattened AS paths (asns split by lengths) in a single pass.
+
+    Plain loop version of the NumPy code in batch_link_keys, compiled with Numba when it
+    is installed: no intermediate pair/mask arrays, one output slot per link.
+    """
+    link_keys = np.empty(len(asns), dtype=np.uint64)
+    count = 0
+    start = 0
+    for length in lengths:
+        if length == 0:
+            continue
+        last = asns[start]
+        for i in range(start + 1, start + length):
+            asn = asns[i]
+            if asn != last: # Skip prepended (repeated) ASNs
+                low, high = (last, asn) if last < asn else (asn, last)
+                link_keys[count] = (np.uint64(low) << np.uint64(32)) | np.uint64(high)
+                count += 1
+                last = asn
+        start += length
+    return link_keys[:count]
+
+
+if njit is not None:
+    collapse_and_pack = njit(cache=True)(collapse_and_pack)
+
+
+def batch_link_keys(batch):
+    """Returns the packed link keys for every adjacent ASN pair in a batch of AS paths."""
+    lengths = np.fromiter(map(len, batch), dtype=np.int64, count=len(batch))
+    asns = np.fromiter(chain.from_iterable(batch), dtype=np.uint32, count=int(lengths.sum()))
+    if njit is not None:
+        return collapse_and_pack(asns, lengths)
+
+    path_ids = np.repeat(np.arange(len(batch)), lengths)
+
+    # Adjacent pairs across the whole flattened batch; keep those inside one path whose
+    # ends differ. Prepending (consecutive duplicates) never forms a link, so dropping
+    # equal pairs has the same effect as collapsing each path first.
+    sources = asns[:-1]
+    targets = asns[1:]
+    same_path = path_ids[:-1] == path_ids[1:]
+    mask = same_path & (sources != targets)
+    return pack_links(sources[mask], targets[mask])
+
+
+def build_link_keys(as_paths):
+    """Collects the unique undirected AS links seen in an iterable of AS paths.
+
+    Links are packed into uint64 keys (see pack_links) and deduplicated with pandas, one
+    batch of paths at a time. Returns a (link_keys, processed_paths) tuple.
+    """
+    key_batches = []
+    processed_paths = 0
+    for batch in iter_batches(as_paths, GRAPH_BATCH_PATHS):
+        link_keys = batch_link_keys(batch)
+        if len(link_keys):
+            add_link_keys(key_batches, unique_keys(link_keys))
+
+        # Progress is reported by the caller (the parsing generators or the pool parent);
+        # pool workers only ever see their own batch
+        processed_paths += len(batch)
 
-        print(f"Finished parsing. Total valid RIB entries found: {count}")
-        if skipped_no_path > 0:
-             print(f"Skipped {skipped_no_path} entries due to missing/empty AS paths.")
-        return records # Return records directly
+    return merge_link_keys(key_batches), processed_paths
+
+
+def link_keys_from_json_lines(lines):
+    """Pool worker: builds the unique packed link keys for a batch of bgpkit-parser JSON lines."""
+    return build_link_keys(as_paths_from_json_lines(lines))
+
+
+def iter_batches(iterable, size):
+    """Yields lists of up to `size` consecutive items from `iterable`."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_pool_results(pool, func, batches, max_pending):
+    """Runs func over batches in the pool, yielding results in order.
+
+    At most max_pending batches are in flight, so a fast producer can't queue the whole
+    input in memory.
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append(pool.apply_async(func, (batch,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def to_graph_data(link_keys):
+    """Builds the graph data from packed link keys (or None if the graph is empty).
+
+    Nodes (uint32 ASNs) and links (packed uint64 keys) stay NumPy arrays; they are only
+    turned into D3 records while being written out (see save_graph_data).
+    """
+    if not len(link_keys):
+        print("No AS paths to analyze.")
+        return None
+
+    sources, targets = unpack_links(link_keys)
+    nodes = unique_keys(np.concatenate([sources, targets]))
+    print(f"Analysis complete. Found {len(nodes)} unique ASes and {len(link_keys)} unique links.")
+
+    graph_data = {
+        "nodes": nodes,
+        "links": link_keys
+    }
+    return graph_data
+
+
+def build_link_keys_in_parallel(mrt_path, workers, url=None):
+    """Collects the unique packed link keys from the bgpkit-parser CLI output using a process pool.
+
+    The CLI output is cut into batches of JSON lines; each worker decodes its batch and
+    returns its unique link keys, which are merged here. `url` is passed on to
+    iter_cli_json_lines to download the dump while it is parsed. Returns a
+    (link_keys, processed_paths) tuple like build_link_keys.
+    """
+    print(f"Building the graph with {workers} worker processes...")
+    key_batches = []
+    processed_paths = 0
+    with multiprocessing.Pool(workers) as pool:
+        batches = iter_batches(iter_cli_json_lines(mrt_path, url), PARSE_BATCH_LINES)
+        for batch_keys, batch_paths in iter_pool_results(pool, link_keys_from_json_lines, batches, 2 * workers):
+            add_link_keys(key_batches, batch_keys)
+            previous_paths = processed_paths
+            processed_paths += batch_paths
+            if processed_paths // 100000 > previous_paths // 100000:
+                print(f"  Processed {processed_paths // 100000 * 100000} AS paths...")
+        link_keys = merge_link_keys(key_batches)
+
+    print(f"Finished parsing. Total AS paths processed: {processed_paths}")
+    return link_keys, processed_paths
+
+
+def analyze_link_keys(build_keys, *args):
+    """Runs a link key builder (build_link_keys or build_link_keys_in_parallel) on args
+    and turns its result into graph data.
+
+    Parsing happens lazily while the keys are built, so parser errors surface here and
+    are reported as a failure (None). Download errors are left to the caller.
+    """
+    print("Analyzing AS paths to build graph...")
+    try:
+        link_keys, _ = build_keys(*args)
+    except DownloadError:
+        raise # Not a parsing problem; the caller handles it
     except Exception as e:
-        # Print more detailed error if possible
         import traceback
         print(f"Error during BGPKit parsing: {e}")
         print(traceback.format_exc())
         return None # Indicate failure
 
+    return to_graph_data(link_keys)
 
-def analyze_routes_to_graph(records):
-    """Analyzes parsed routes to create an AS graph structure."""
-    if not records:
-        print("No records to analyze.")
-        return None
-
-    print("Analyzing AS paths to build graph...")
-    nodes = set()
-    links = set()
 
-    processed_paths = 0
-    for record in records:
-        # The as_path should already be a list of strings from the parser function
-        as_path_list = record.get("as_path")
-
-        if not as_path_list or len(as_path_list) < 2:
-            continue # Need at least two ASes for a link
-
-        # Flatten prepended paths (remove consecutive duplicates)
-        cleaned_path = []
-        last_asn = None
-        for asn_str in as_path_list:
-            # ASN should already be a string digit from parser
-            if asn_str != last_asn:
-                cleaned_path.append(asn_str)
-                last_asn = asn_str
-
-        if len(cleaned_path) < 2:
-            continue
+def analyze_routes_to_graph(as_paths):
+    """Builds an AS graph structure from an iterable of AS paths (lists of int ASNs).
 
-        for i in range(len(cleaned_path) - 1):
-            source = cleaned_path[i]
-            target = cleaned_path[i+1]
+    The paths are consumed one at a time (e.g. straight from iter_as_paths), so the
+    parsed RIB is never held in memory in full.
+    """
+    return analyze_link_keys(build_link_keys, as_paths)
 
-            # Add nodes
-            nodes.add(source)
-            nodes.add(target)
 
-            # Add link (store as sorted tuple for undirected graph)
-            links.add(tuple(sorted((source, target))))
+def analyze_routes_in_parallel(mrt_path, workers, url=None):
+    """Builds the AS graph from the bgpkit-parser CLI output using a pool of worker processes."""
+    return analyze_link_keys(build_link_keys_in_parallel, mrt_path, workers, url)
 
-        processed_paths += 1
-        if processed_paths % 100000 == 0:
-            print(f"  Processed {processed_paths} AS paths...")
 
-    print(f"Analysis complete. Found {len(nodes)} unique ASes and {len(links)} unique links.")
+def write_ndjson(line_template, columns, output_path):
+    """Streams NDJSON records formatted from NumPy columns, NDJSON_WRITE_BATCH rows at a time.
 
-    # Convert to D3 format
-    graph_data = {
-        "nodes": [{"id": node_id} for node_id in nodes],
-        "links": [{"source": link_tuple[0], "target": link_tuple[1]} for link_tuple in links]
-    }
-    return graph_data
+    ASNs are plain digits, so each line is formatted directly from line_template
+    (ASNs only become strings here) without building a dict per record.
+    """
+    with open(output_path, "wb") as f:
+        for start in range(0, len(columns[0]), NDJSON_WRITE_BATCH):
+            rows = zip(*(column[start:start + NDJSON_WRITE_BATCH].tolist() for column in columns))
+            f.write("".join(line_template % row for row in rows).encode())
 
 
-def save_graph_data(graph_data, output_path):
-    """Saves the graph data to a JSON file."""
+def save_graph_data(graph_data, nodes_path, links_path):
+    """Saves the graph nodes and links to NDJSON files."""
     if not graph_data:
         print("No graph data to save.")
         return False
 
-    print(f"Saving graph data to {output_path}...")
+    print(f"Saving graph data to {nodes_path} and {links_path}...")
     try:
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w") as f:
-            json.dump(graph_data, f) # No indent for smaller file size
+        os.makedirs(os.path.dirname(nodes_path), exist_ok=True)
+        os.makedirs(os.path.dirname(links_path), exist_ok=True)
+        write_ndjson('{"id":"%d"}\n', [graph_data["nodes"]], nodes_path)
+        write_ndjson('{"source":"%d","target":"%d"}\n', unpack_links(graph_data["links"]), links_path)
         print("Graph data saved successfully.")
         return True
     except Exception as e:
@@ -177,25 +617,29 @@ if __name__ == "__main__":
     print("--- Starting MRT Data Pipeline ---")
 
     # 1. Collection
-    if not download_mrt_file(MRT_URL, DOWNLOAD_PATH_GZ):
+    # With the CLI and pigz available the download is streamed straight into the parser
+    # (steps 1-3 overlap); otherwise the dump is fully downloaded first.
+    stream_url = MRT_URL if BGPKIT_CLI and PIGZ else None
+    if stream_url is None and not download_mrt_file(MRT_URL, DOWNLOAD_PATH_GZ):
         print("Pipeline aborted due to download failure.")
         exit(1)
 
-    # 2. Parsing (using bgpkit-parser on the downloaded .gz file)
-    # No decompression step needed.
+    # 2+3. Parsing and Analysis in a single streaming pass
+    # (bgpkit-parser reads the downloaded .gz file directly, no decompression step needed)
     mrt_source_path = DOWNLOAD_PATH_GZ
-    records = parse_mrt_to_records(mrt_source_path) # Use the new parser function
-
-    if records is None:
-        print("Pipeline aborted due to parsing failure.")
-        cleanup_files(DOWNLOAD_PATH_GZ) # Only need to clean up the downloaded file
+    try:
+        if BGPKIT_CLI and PARSE_WORKERS > 1:
+            graph_data = analyze_routes_in_parallel(mrt_source_path, PARSE_WORKERS, stream_url)
+        else:
+            graph_data = analyze_routes_to_graph(iter_as_paths(mrt_source_path, stream_url))
+    except DownloadError as e:
+        # The streamed download failed; it only wrote a .part file, so any cached dump is intact
+        print(f"Pipeline aborted due to download failure: {e}")
         exit(1)
-
-    # 3. Analysis
-    graph_data = analyze_routes_to_graph(records)
     if graph_data is None:
-        print("Pipeline aborted due to analysis failure.")
-        cleanup_files(DOWNLOAD_PATH_GZ)
+        print("Pipeline aborted due to parsing/analysis failure.")
+        # The dump may be corrupt; don't keep it as a cached copy
+        cleanup_files(DOWNLOAD_PATH_GZ, etag_path_for(DOWNLOAD_PATH_GZ))
         exit(1)
 
     # Optional: Limit graph size check (can remove if performance is okay)
@@ -210,12 +654,14 @@ if __name__ == "__main__":
         pass
 
     # 4. Save Output for Visualization
-    if not save_graph_data(graph_data, OUTPUT_GRAPH_PATH):
+    if not save_graph_data(graph_data, OUTPUT_NODES_PATH, OUTPUT_LINKS_PATH):
         print("Pipeline aborted due to saving failure.")
-        cleanup_files(DOWNLOAD_PATH_GZ)
+        if not CACHE_DOWNLOAD:
+            cleanup_files(DOWNLOAD_PATH_GZ, etag_path_for(DOWNLOAD_PATH_GZ))
         exit(1)
 
-    # 5. Cleanup
-    cleanup_files(DOWNLOAD_PATH_GZ) # Only need to clean up the downloaded file
+    # 5. Cleanup (unless the dump is kept as a cache for the next run)
+    if not CACHE_DOWNLOAD:
+        cleanup_files(DOWNLOAD_PATH_GZ, etag_path_for(DOWNLOAD_PATH_GZ))
 
     print("--- MRT Data Pipeline Finished Successfully ---")
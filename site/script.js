@@ -15,8 +15,16 @@ document.addEventListener('DOMContentLoaded', () => {
         .style("border-radius", "3px")
         .style("font-size", "12px");
 
+    // Parse a newline-delimited JSON file (one record per line)
+    function loadNdjson(url) {
+        return d3.text(url).then(text => text.split("\n")
+            .filter(line => line.trim())
+            .map(line => JSON.parse(line)));
+    }
+
     // Fetch the graph data
-    d3.json("data/as_graph.json").then(function(graph) {
+    Promise.all([loadNdjson("data/nodes.ndjson"), loadNdjson("data/links.ndjson")]).then(function([nodes, links]) {
+        const graph = { nodes, links };
         loadingIndicator.style("display", "none"); // Hide loading indicator
         svg.style("display", "block"); // Show SVG
 